@@ -1,9 +1,19 @@
 import os
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from databricks import sql
 from databricks.sdk.core import Config
-import time
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import queue
+import io
+import tempfile
+import uuid
 
 # Set the page configuration
 st.set_page_config(page_title="Configuration Editor", layout="wide")
@@ -18,247 +28,471 @@ assert os.getenv('SCHEMA'), "SCHEMA must be set in the environment."
 
 http_path = f"/sql/1.0/warehouses/{os.getenv('DATABRICKS_WAREHOUSE_ID')}"
 
-# Cache the connection
-@st.cache_resource
-def get_connection():
+# Resolve the requesting user's token; reads and saves both run as this user
+def current_user_token() -> str:
     user_token = st.context.headers.get('X-Forwarded-Access-Token')
     if not user_token:
         # check if it's in an env variable
         user_token = os.getenv('USER_TOKEN')
         if not user_token:
             raise ValueError("User token not found in request headers.")
+    return user_token
+
+# Open a connection authenticated with the given user token
+def open_connection(user_token: str):
     return sql.connect(
         server_hostname=cfg.host,
         http_path=http_path,
-        access_token=user_token
+        access_token=user_token,
+        # Volume staging commands (PUT/REMOVE) are only allowed when a local path is configured
+        staging_allowed_local_path=tempfile.gettempdir()
     )
 
+# Idle connections for one user token, kept across reruns. Tokens are
+# short-lived, so pools for expired tokens are released after an hour
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_connection_pool(user_token: str) -> queue.SimpleQueue:
+    return queue.SimpleQueue()
+
+# Connections cannot be shared between threads (the connector declares
+# threadsafety = 1), so every borrower takes its own connection from the
+# user's pool and returns it for later reads and saves to reuse. A connection
+# whose work failed is closed rather than returned, in case its session broke
+@contextlib.contextmanager
+def borrow_connection(user_token: str):
+    pool = get_connection_pool(user_token)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = open_connection(user_token)
+    try:
+        yield conn
+    except Exception:
+        conn.close()
+        raise
+    pool.put(conn)
+
+# Thread pool whose workers share this run's script context, so cached
+# functions and st.* calls keep working from inside them
+@contextlib.contextmanager
+def script_executor(max_workers: int):
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        yield executor
+
 # Fetch list of tables
-@st.cache_data
-def get_tables(catalog, schema):
-    conn = get_connection()
-    with conn.cursor() as cursor:
+@st.cache_data(show_spinner=False)
+def get_tables(user_token, catalog, schema):
+    with borrow_connection(user_token) as conn, conn.cursor() as cursor:
         cursor.execute(f"SHOW TABLES IN {catalog}.{schema}")
         tables = [f"{catalog}.{schema}.{row['tableName']}" for row in cursor.fetchall()]
     return tables
 
-# Dynamically fetch primary keys for a table
-@st.cache_data
-def get_primary_key(catalog, schema, table):
-    conn = get_connection()
-    query = f"""
-    SELECT kcu.column_name
-    FROM {catalog}.information_schema.key_column_usage kcu
-    JOIN {catalog}.information_schema.table_constraints tc
-    ON kcu.constraint_name = tc.constraint_name
+# Dynamically fetch primary keys for every table in the schema in one query
+@st.cache_data(show_spinner=False)
+def get_primary_keys_for_schema(user_token, catalog, schema) -> dict:
+    query = """
+    SELECT tc.table_name, kcu.column_name
+    FROM IDENTIFIER(:catalog || '.information_schema.key_column_usage') kcu
+    JOIN IDENTIFIER(:catalog || '.information_schema.table_constraints') tc
+    ON kcu.constraint_schema = tc.constraint_schema
+      AND kcu.constraint_name = tc.constraint_name
     WHERE tc.constraint_type = 'PRIMARY KEY'
-      AND tc.table_schema = '{schema}'
-      AND tc.table_name = '{table}'
+      AND tc.table_schema = :schema
+    ORDER BY tc.table_name, kcu.ordinal_position
+    """
+    with borrow_connection(user_token) as conn, conn.cursor() as cursor:
+        cursor.execute(query, {'catalog': catalog, 'schema': schema})
+        primary_keys = {}
+        for row in cursor.fetchall():
+            primary_keys.setdefault(row['table_name'], []).append(row['column_name'])
+        return primary_keys
+
+# Fetch the ordered column names of every table in the schema in one query.
+# Expires with read_table so schema changes reach the projected SELECT
+@st.cache_data(ttl=300, show_spinner=False)
+def get_columns_for_schema(user_token, catalog, schema) -> dict:
+    query = """
+    SELECT table_name, column_name
+    FROM IDENTIFIER(:catalog || '.information_schema.columns')
+    WHERE table_schema = :schema
+    ORDER BY table_name, ordinal_position
     """
-    with conn.cursor() as cursor:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        if rows:
-            return [row['column_name'] for row in rows]
-        return []
-
-# Read table data without caching
-def read_table(table_name: str) -> pd.DataFrame:
-    conn = get_connection()
-    with conn.cursor() as cursor:
-        cursor.execute(f"SELECT * FROM {table_name}")
-        df = cursor.fetchall_arrow().to_pandas()
+    with borrow_connection(user_token) as conn, conn.cursor() as cursor:
+        cursor.execute(query, {'catalog': catalog, 'schema': schema})
+        columns = {}
+        for row in cursor.fetchall():
+            columns.setdefault(row['table_name'], []).append(row['column_name'])
+        return columns
+
+# Columns the editor needs: everything not hidden, plus keys and managed timestamps
+def projected_columns(table_columns: list, primary_keys: list, hidden_columns: list):
+    if not hidden_columns or not table_columns:
+        return None
+    required = set(primary_keys) | {'CreatedAt', 'UpdatedAt'}
+    return tuple(col for col in table_columns if col not in hidden_columns or col in required)
+
+# Read table data, cached until the table's refresh token is bumped by a save
+@st.cache_data(ttl=300, show_spinner=False)
+def read_table(user_token: str, table_name: str, refresh_token: str = '', columns: tuple = None) -> pa.Table:
+    select_list = ', '.join(columns) if columns else '*'
+    with borrow_connection(user_token) as conn, conn.cursor() as cursor:
+        cursor.execute(f"SELECT {select_list} FROM IDENTIFIER(:table_name)", {'table_name': table_name})
+        tbl = cursor.fetchall_arrow()
     
-    # Convert timestamp columns
+    # Convert epoch timestamp columns in Arrow; pandas conversion happens at the editor
     for col in ['CreatedAt', 'UpdatedAt']:
-        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-            if pd.api.types.is_numeric_dtype(df[col]):
-                max_val = df[col].max()
-                unit = 'ms' if max_val >= 1e12 else 's'
-                df[col] = pd.to_datetime(df[col], unit=unit, utc=True)
+        col_type = tbl.schema.field(col).type if col in tbl.schema.names else None
+        if col_type is not None and (pa.types.is_integer(col_type) or pa.types.is_floating(col_type) or pa.types.is_decimal(col_type)):
+            max_val = pc.max(tbl[col]).as_py()
+            unit = 'ms' if max_val is not None and max_val >= 1e12 else 's'
+            # Fractional DOUBLE/DECIMAL epochs are truncated to whole units
+            converted = pc.cast(tbl[col], pa.int64(), safe=False).cast(pa.timestamp(unit, tz='UTC'))
+            tbl = tbl.set_column(tbl.schema.get_field_index(col), col, converted)
     
-    return df
+    return tbl
+
+# Databricks caps the number of native parameters bound to a single statement
+MAX_PARAMS = 256
+
+# Edits binding more parameters than this are staged as Parquet on a volume instead, when one is configured
+STAGING_MIN_PARAMS = 4 * MAX_PARAMS
+
+# Upper bound on cell values per staged MERGE batch, keeping each statement's source small enough to compile quickly
+MAX_BATCH_VALUES = 50000
+
+# Yield row slices holding at most max_params cell values, e.g. to fit one statement's parameter cap
+def _chunk_rows(df: pd.DataFrame, cols_per_row: int, max_params: int = MAX_PARAMS):
+    step = max(1, max_params // cols_per_row)
+    for i in range(0, len(df), step):
+        yield df.iloc[i:i + step]
+
+# Unity Catalog volume used to stage large edits; without one every edit is bound as parameters
+STAGING_VOLUME = os.getenv('STAGING_VOLUME', '').rstrip('/')
+
+# Multi-statement transactions need warehouse and table support, so they are opt-in
+USE_TRANSACTIONS = os.getenv('MULTI_STATEMENT_TRANSACTIONS', '').lower() in ('1', 'true', 'yes')
+
+# Build the MERGE for one parameter-sized chunk of rows bound inline as a VALUES source
+def _values_merge(merge_template: str, chunk: pd.DataFrame) -> tuple:
+    row_placeholder = f"({', '.join(['?'] * len(chunk.columns))})"
+    source_sql = f"(SELECT * FROM (VALUES {', '.join([row_placeholder] * len(chunk))}) AS v({', '.join(chunk.columns)}))"
+    return merge_template.format(source=source_sql), chunk.to_numpy(dtype=object).ravel().tolist()
+
+# Upload a batch as Zstd-compressed Parquet and expose it as a temp view. The
+# explicit schema keeps all-null columns typed instead of inferring Arrow's null type
+def _stage_batch(cursor, batch: pd.DataFrame, schema: pa.Schema, temp_view: str, staging_path: str):
+    buf = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(batch, schema=schema, preserve_index=False), buf, compression='zstd')
+    buf.seek(0)
+    cursor.execute(f"PUT '__input_stream__' INTO '{staging_path}' OVERWRITE", input_stream=buf)
+    cursor.execute(f"CREATE OR REPLACE TEMP VIEW {temp_view} AS SELECT * FROM parquet.`{staging_path}`")
+
+# Queue a message for the rerun that follows a save, which would otherwise clear it
+def queue_notice(kind: str, message: str, icon: str = None):
+    st.session_state.setdefault('pending_notices', []).append((kind, message, icon))
+
+# Show the queued messages once
+def show_pending_notices():
+    for kind, message, icon in st.session_state.pop('pending_notices', []):
+        getattr(st, kind)(message, icon=icon)
+
+# Run the MERGE statements in order, reporting progress when there are several.
+# With transactions enabled they commit atomically; if the warehouse rejects
+# BEGIN, the user is warned and the statements run on their own as they would
+# without the option. Statements run on their own commit one by one, so when a
+# later one fails the earlier ones stay applied: that partial save is reported
+# and False returned instead of raising. Returns True when every statement ran.
+def _run_merges(cursor, statements: list) -> bool:
+    batched = len(statements) > 1
+    in_transaction = False
+    if batched and USE_TRANSACTIONS:
+        try:
+            cursor.execute("BEGIN TRANSACTION")
+            in_transaction = True
+        except Exception as e:
+            queue_notice('warning', f"Could not start a transaction, so batches were saved one at a time: {str(e)}", "⚠️")
+    progress = st.progress(0.0, text="Saving changes...") if batched else None
+    completed = 0
+    try:
+        for merge_sql, params in statements:
+            cursor.execute(merge_sql, params)
+            completed += 1
+            if batched:
+                progress.progress(completed / len(statements), text=f"Saved batch {completed} of {len(statements)}")
+        if in_transaction:
+            cursor.execute("COMMIT")
+    except Exception as e:
+        if in_transaction:
+            # A failing ROLLBACK must not hide the MERGE error being re-raised
+            with contextlib.suppress(Exception):
+                cursor.execute("ROLLBACK")
+            raise
+        if not completed:
+            raise
+        queue_notice(
+            'warning',
+            f"Only {completed} of {len(statements)} batches were saved; the remaining changes were not applied: {str(e)}",
+            "⚠️"
+        )
+        return False
+    finally:
+        if batched:
+            progress.empty()
+    return True
+
+# Build the MERGE statement once per table shape and keep it across reruns; only the
+# {source} relation varies per call
+@st.cache_data(show_spinner=False)
+def _build_merge_template(table_name: str, all_columns: tuple, primary_keys: tuple) -> str:
+    columns_to_exclude = ['CreatedAt', 'UpdatedAt']
+    on_clause = ' AND '.join([f"t.{pk} = s.{pk}" for pk in primary_keys])
+    update_set = ', '.join(
+        [f"t.{col} = s.{col}" for col in all_columns if col not in columns_to_exclude and col not in primary_keys]
+        + ['t.UpdatedAt = CURRENT_TIMESTAMP()']
+    )
+    insert_columns = ', '.join(all_columns)
+    insert_values = ', '.join([
+        'CURRENT_TIMESTAMP()' if col in columns_to_exclude else f"s.{col}"
+        for col in all_columns
+    ])
+    return f"""
+    MERGE INTO {table_name} AS t
+    USING {{source}} AS s
+    ON {on_clause}
+    WHEN MATCHED AND s.is_delete = TRUE THEN DELETE
+    WHEN MATCHED AND s.is_delete = FALSE THEN UPDATE SET {update_set}
+    WHEN NOT MATCHED AND s.is_delete = FALSE THEN INSERT ({insert_columns}) VALUES ({insert_values})
+    """
 
 # Save changes with MERGE including delete functionality
-def save_changes(table_name: str, source_df: pd.DataFrame, primary_keys: list, all_columns: list, conn):
+def save_changes(table_name: str, source_df: pd.DataFrame, primary_keys: list, table_schema: pa.Schema, conn):
     if not primary_keys:
         st.error(f"No primary key defined for table {table_name}. Cannot perform upsert or delete.")
-        return
+        return False
+
+    # Nothing changed, so skip the warehouse round trip entirely
+    if source_df.empty:
+        st.toast("No changes to save.", icon="ℹ️")
+        return False
 
     try:
-        # Exclude timestamp columns from the temporary view
+        # Exclude timestamp columns from the MERGE source
         columns_to_exclude = ['CreatedAt', 'UpdatedAt']
         df_for_view = source_df.drop(columns=[col for col in columns_to_exclude if col in source_df.columns])
-        temp_view = f"temp_{table_name.replace('.', '_')}_{int(time.time())}"
-        columns = ', '.join(df_for_view.columns)
-        values_list = [
-            f"({', '.join([format_value(row[col], df_for_view.dtypes[col]) for col in df_for_view.columns])})"
-            for index, row in df_for_view.iterrows()
-        ]
-        values_clause = ', '.join(values_list)
-        create_view_sql = f"""
-        CREATE TEMPORARY VIEW {temp_view} AS
-        SELECT * FROM (
-            VALUES {values_clause}
-        ) AS t ({columns})
-        """
-        with conn.cursor() as cursor:
-            cursor.execute(create_view_sql)
-
-        # Define MERGE components
-        on_clause = ' AND '.join([f"t.{pk} = s.{pk}" for pk in primary_keys])
-        source_columns = [col for col in all_columns if col not in columns_to_exclude]
-        update_set = ', '.join([f"t.{col} = s.{col}" for col in source_columns if col not in primary_keys])
-        if update_set:
-            update_set += ', '
-        update_set += 't.UpdatedAt = CURRENT_TIMESTAMP()'
-        insert_columns = ', '.join(all_columns)
-        insert_values_list = [
-            'CURRENT_TIMESTAMP()' if col in columns_to_exclude else f"s.{col}"
-            for col in all_columns
-        ]
-        insert_values = ', '.join(insert_values_list)
-
-        # Construct MERGE statement with delete clause
-        merge_sql = f"""
-        MERGE INTO {table_name} AS t
-        USING {temp_view} AS s
-        ON {on_clause}
-        WHEN MATCHED AND s.is_delete = TRUE THEN DELETE
-        WHEN MATCHED AND s.is_delete = FALSE THEN UPDATE SET {update_set}
-        WHEN NOT MATCHED AND s.is_delete = FALSE THEN INSERT ({insert_columns}) VALUES ({insert_values})
-        """
-
-        with conn.cursor() as cursor:
-            cursor.execute(merge_sql)
-        st.toast("Changes saved successfully!", icon="✅")
+        merge_template = _build_merge_template(table_name, tuple(table_schema.names), tuple(primary_keys))
+
+        with st.spinner("Saving changes..."), conn.cursor() as cursor:
+            staged = []
+            try:
+                if STAGING_VOLUME and df_for_view.size > STAGING_MIN_PARAMS:
+                    # Stage large edits in batches so no single MERGE compiles an oversized source.
+                    # Every upload and view is created before the MERGEs run, keeping file
+                    # operations and DDL out of any transaction
+                    staging_schema = pa.schema(
+                        [table_schema.field(col) for col in df_for_view.columns if col != 'is_delete']
+                        + [pa.field('is_delete', pa.bool_())]
+                    )
+                    statements = []
+                    for batch in _chunk_rows(df_for_view, len(df_for_view.columns), MAX_BATCH_VALUES):
+                        temp_view = f"temp_{table_name.replace('.', '_')}_{uuid.uuid4().hex}"
+                        staging_path = f"{STAGING_VOLUME}/{temp_view}.parquet"
+                        staged.append((temp_view, staging_path))
+                        _stage_batch(cursor, batch, staging_schema, temp_view, staging_path)
+                        statements.append((merge_template.format(source=temp_view), None))
+                else:
+                    params_df = pd.concat([format_column(df_for_view[col]) for col in df_for_view.columns], axis=1)
+                    statements = [
+                        _values_merge(merge_template, chunk)
+                        for chunk in _chunk_rows(params_df, len(params_df.columns))
+                    ]
+                complete = _run_merges(cursor, statements)
+            finally:
+                # Staged views and files are only needed until the MERGEs finish, and views
+                # would otherwise pile up on the pooled session; a failed cleanup leaves a
+                # stray view or file but must not mask the save's outcome
+                for temp_view, staging_path in staged:
+                    with contextlib.suppress(Exception):
+                        cursor.execute(f"DROP VIEW IF EXISTS {temp_view}")
+                    with contextlib.suppress(Exception):
+                        cursor.execute(f"REMOVE '{staging_path}'")
+        # Partial saves still return True so the table reloads with what was applied
+        if complete:
+            queue_notice('toast', "Changes saved successfully!", "✅")
+        return True
     except Exception as e:
         st.error(f"Error saving changes: {str(e)}")
+        return False
 
-# Helper function to format values for SQL
-def format_value(value, dtype):
-    if pd.isnull(value):
-        return 'NULL'
-    if dtype == 'bool':
-        return str(value).upper()
-    if dtype == 'object':
-        escaped_value = str(value).replace("'", "''")
-        return f"'{escaped_value}'"
-    elif dtype in ['int64', 'float64']:
-        return str(value)
-    else:
-        escaped_value = str(value).replace("'", "''")
-        return f"'{escaped_value}'"
-
-def handle_table_edits(full_table: str, original_df: pd.DataFrame, primary_keys: list):
+# Helper function to convert a column into native query parameters
+def format_column(s: pd.Series) -> pd.Series:
+    # astype(object) unwraps NumPy scalars into Python values in one pass over the column
+    return s.astype(object).where(s.notna(), None)
+
+def handle_table_edits(full_table: str, original_tbl: pa.Table, primary_keys: list, hidden_columns: list, user_token: str):
     """Handle the editing and saving of a single table."""
+    # The Arrow table stays the source of truth; pandas is only needed by the editor
+    original_df = original_tbl.to_pandas()
     column_config = {
         "CreatedAt": st.column_config.DatetimeColumn(disabled=True),
         "UpdatedAt": st.column_config.DatetimeColumn(disabled=True)
     }
+    # Hidden key columns are still read for saving, but kept out of view
+    column_config.update({col: None for col in hidden_columns if col in original_df.columns})
     
-    # Create unique keys for this table
-    editor_key = f"editor_{full_table}"
-    data_key = f"data_{full_table}"
+    # Create unique keys for this table; the editor key follows the refresh
+    # token so a reload after saving starts from a clean set of edits
+    refresh_token = st.session_state.refresh_counters.get(full_table, '')
+    editor_key = f"editor_{full_table}_{refresh_token}"
     changes_key = f"changes_{full_table}"
     
-    # Initialize session state for this table's data if it doesn't exist
-    if data_key not in st.session_state:
-        st.session_state[data_key] = original_df.copy()
-        st.session_state[changes_key] = False
-    
     # Use the data editor with the current data
     edited_df = st.data_editor(
-        st.session_state[data_key],
+        original_df,
         num_rows="dynamic",
         hide_index=True,
         column_config=column_config,
-        key=editor_key,
-        on_change=lambda: setattr(st.session_state, changes_key, True)
+        key=editor_key
     )
     
-    # Check if data has changed
-    data_changed = not edited_df.equals(st.session_state[data_key])
-    if data_changed:
-        st.session_state[changes_key] = True
-        st.session_state[data_key] = edited_df.copy()
+    # Streamlit already tracks the edits as deltas against original_df
+    delta = st.session_state[editor_key]
+    st.session_state[changes_key] = bool(delta["edited_rows"] or delta["added_rows"] or delta["deleted_rows"])
     
     # Show save button if changes were made
     if st.session_state[changes_key]:
         if st.button("Save Changes", key=f"save_{full_table}"):
             try:
-                # Detect deleted rows
-                original_keys = set(st.session_state[data_key][primary_keys].itertuples(index=False, name=None))
-                edited_keys = set(edited_df[primary_keys].itertuples(index=False, name=None))
-                deleted_keys = original_keys - edited_keys
+                # Detect deleted rows with an Arrow anti-join on the primary key columns.
+                # Rows without a full key cannot match an existing row, and casting to the
+                # original key schema keeps the join types aligned when an added row
+                # widened a column
+                original_keys = original_tbl.select(primary_keys)
+                edited_keys = pa.Table.from_pandas(edited_df[primary_keys].dropna(), preserve_index=False).cast(original_keys.schema)
+                deleted_keys = original_keys.join(edited_keys, keys=primary_keys, join_type='left anti')
+
+                # Prepare rows for deletion from the key columns alone; the other columns
+                # are filled with nulls as object dtype so concatenating them with the
+                # upserts cannot coerce existing integer values to float
+                delete_rows = deleted_keys.select(primary_keys).to_pandas().reindex(columns=original_df.columns)
+                delete_rows = delete_rows.astype({col: object for col in delete_rows.columns if col not in primary_keys})
                 
-                # Prepare rows for deletion
-                delete_rows = st.session_state[data_key][st.session_state[data_key][primary_keys].apply(lambda row: tuple(row), axis=1).isin(deleted_keys)].copy()
-                for col in delete_rows.columns:
-                    if col not in primary_keys:
-                        delete_rows[col] = None
+                # Only upsert the rows the editor reports as edited or added
+                edited_labels = original_df.index[list(delta["edited_rows"])]
+                upsert_mask = edited_df.index.isin(edited_labels) | ~edited_df.index.isin(original_df.index)
+                upsert_rows = edited_df.loc[upsert_mask]
                 
-                # Combine edited and deleted rows
-                source_df = pd.concat([
-                    edited_df.assign(is_delete=False),
-                    delete_rows.assign(is_delete=True)
+                # Combine edited and deleted rows in one allocation, then flag the deletes
+                source_df = pd.concat([upsert_rows, delete_rows], ignore_index=True)
+                source_df['is_delete'] = np.concatenate([
+                    np.zeros(len(upsert_rows), dtype=bool),
+                    np.ones(len(delete_rows), dtype=bool)
                 ])
                 
                 # Save changes
-                conn = get_connection()
-                save_changes(full_table, source_df, primary_keys, list(st.session_state[data_key].columns), conn)
+                with borrow_connection(user_token) as conn:
+                    saved = save_changes(full_table, source_df, primary_keys, original_tbl.schema, conn)
                 
-                # Reset changes flag
+                # Reset changes flag and invalidate the cached table data
                 st.session_state[changes_key] = False
+                if saved:
+                    st.session_state.refresh_counters[full_table] = uuid.uuid4().hex
+                    # Rerun so the editor is rebuilt from the reloaded data straight away;
+                    # otherwise the next edit only remounts it and is lost
+                    st.rerun()
+                # No rerun follows a failed save, so show its queued messages now
+                show_pending_notices()
                 
             except Exception as e:
                 st.error(f"Error saving changes: {str(e)}")
 
 # Main app layout
-st.title("Configuration Editor")
-
 # Schema details from environment variables
 catalog = os.getenv('CATALOG')
 schema = os.getenv('SCHEMA')
-tables = get_tables(catalog, schema)
 
-# Display tables
-for full_table in tables:
-    table_name = full_table.split('.')[-1]
-    expander_key = f"expander_{full_table}"
-    
-    # Initialize expander state if not exists
-    if expander_key not in st.session_state:
-        st.session_state[expander_key] = False
-    
-    # Create a container for the table
-    table_container = st.container()
-    with table_container:
-        # Force expander to stay open if there are unsaved changes
-        changes_key = f"changes_{full_table}"
-        is_expanded = st.session_state[expander_key] or (changes_key in st.session_state and st.session_state[changes_key])
-        
-        with st.expander(f"📋 {table_name}", expanded=is_expanded):
-            try:
-                # Get primary keys
-                primary_keys = get_primary_key(catalog, schema, table_name)
-                if not primary_keys:
-                    st.error(f"No primary key found for table {table_name}. Editing is disabled.")
-                    continue
-                
-                # Read and display table data
-                original_df = read_table(full_table)
-                handle_table_edits(full_table, original_df, primary_keys)
-                
-            except Exception as e:
-                st.error(f"Error loading table {table_name}: {str(e)}")
+# Technical columns to leave out of the editor and out of the SELECT
+hidden_columns = [col.strip() for col in os.getenv('HIDDEN_COLUMNS', '').split(',') if col.strip()]
+
+# Every query in this run is made as the requesting user; the token is also part
+# of each cache key so cached results are never shared between users
+user_token = current_user_token()
 
-# Sidebar instructions
-st.sidebar.title("Instructions")
-st.sidebar.write("""
+# Start the metadata lookups first so the warehouse works while the page frame renders
+with script_executor(max_workers=2) as metadata_executor:
+    tables_future = metadata_executor.submit(get_tables, user_token, catalog, schema)
+    primary_keys_future = metadata_executor.submit(get_primary_keys_for_schema, user_token, catalog, schema)
+    columns_future = metadata_executor.submit(get_columns_for_schema, user_token, catalog, schema) if hidden_columns else None
+
+    st.title("Configuration Editor")
+
+    # Show messages queued by a save before it reran the app
+    show_pending_notices()
+
+    # Sidebar instructions
+    st.sidebar.title("Instructions")
+    st.sidebar.write("""
 Expand a table to edit its data. Add, edit, or delete rows, then click 'Save Changes' to update the data.
 - Timestamps (CreatedAt and UpdatedAt) are automatically managed
 - Changes are saved using the table's primary key(s)
 - The editor will only show the save button when changes are detected
-""")
\ No newline at end of file
+""")
+
+    tables = tables_future.result()
+    primary_keys_by_table = primary_keys_future.result()
+    columns_by_table = columns_future.result() if columns_future else {}
+
+# Per-table refresh tokens used to bust the read_table cache after a save. The
+# cache is shared by every session of a user, so each save mints a globally unique
+# token rather than counting up from a value other sessions also use
+if "refresh_counters" not in st.session_state:
+    st.session_state.refresh_counters = {}
+
+# Read every editable table concurrently; results are collected as each expander renders
+tables_to_read = [t for t in tables if primary_keys_by_table.get(t.split('.')[-1])]
+with script_executor(max_workers=min(8, max(1, len(tables_to_read)))) as executor:
+    read_table_futures = {
+        t: executor.submit(
+            read_table,
+            user_token,
+            t,
+            st.session_state.refresh_counters.get(t, ''),
+            projected_columns(columns_by_table.get(t.split('.')[-1]), primary_keys_by_table[t.split('.')[-1]], hidden_columns),
+        )
+        for t in tables_to_read
+    }
+
+    # Display tables
+    for full_table in tables:
+        table_name = full_table.split('.')[-1]
+        expander_key = f"expander_{full_table}"
+
+        # Initialize expander state if not exists
+        if expander_key not in st.session_state:
+            st.session_state[expander_key] = False
+
+        # Create a container for the table
+        table_container = st.container()
+        with table_container:
+            # Force expander to stay open if there are unsaved changes
+            changes_key = f"changes_{full_table}"
+            is_expanded = st.session_state[expander_key] or (changes_key in st.session_state and st.session_state[changes_key])
+
+            with st.expander(f"📋 {table_name}", expanded=is_expanded):
+                try:
+                    # Get primary keys
+                    primary_keys = primary_keys_by_table.get(table_name, [])
+                    if not primary_keys:
+                        st.error(f"No primary key found for table {table_name}. Editing is disabled.")
+                        continue
+
+                    # Read and display table data
+                    original_tbl = read_table_futures[full_table].result()
+                    handle_table_edits(full_table, original_tbl, primary_keys, hidden_columns, user_token)
+
+                except Exception as e:
+                    # A stale column list (e.g. a dropped or renamed column) breaks the
+                    # projected SELECT, so refetch it on the next rerun
+                    if hidden_columns:
+                        get_columns_for_schema.clear()
+                    st.error(f"Error loading table {table_name}: {str(e)}")